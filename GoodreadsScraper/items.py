@@ -5,18 +5,19 @@
 # See documentation in:
 # http://doc.scrapy.org/en/latest/topics/items.html
 import re
-import json
 import datetime
-from typing import Any, Dict
+import functools
+from collections import defaultdict
 
 import scrapy
+import simdjson
 from scrapy import Field
 from scrapy.loader import ItemLoader
 
 from itemloaders.processors import Identity, Compose, MapCompose, TakeFirst, Join
 
 from dateutil.parser import parse as dateutil_parse
-from w3lib.html import remove_tags
+from selectolax.lexbor import LexborHTMLParser
 
 
 DEBUG = False
@@ -30,192 +31,333 @@ def print_schema(d, tabs=1):
         print_schema(d[key], tabs+1)
 
 
-def visit_path(data: Dict[str, Any], key: str, original_key: str):
+def _escape_pointer_token(token: str) -> str:
+    # RFC 6901 escaping; Apollo keys such as "Book:kca://book/..." contain slashes
+    return token.replace('~', '~0').replace('/', '~1')
+
+
+def _compile_path(key: str):
+    """Compile a dotted field path into a tuple of (op, arg) steps for visit_path
+
+        'props.pageProps.apolloState.Book*.bookGenres[].genre.name' becomes
+        (('pointer', '/props/pageProps/apolloState'), ('wildcard', 'Book'),
+         ('pointer', '/bookGenres'), ('each', None), ('pointer', '/genre/name'))
+    """
+    steps = []
+    pointer = ''
+
+    for subkey in key.split('.'):
+        # handle partial matches on the key
+        # this is needed when the key can be dynamic, e.g. 'Book*' matches 'Book:kca://book/...'
+        if subkey.endswith('*'):
+            if pointer:
+                steps.append(('pointer', pointer))
+                pointer = ''
+            steps.append(('wildcard', subkey[:-1]))
+
+        # handle arrays
+        elif subkey.endswith('[]'):
+            steps.append(('pointer', pointer + '/' + _escape_pointer_token(subkey[:-2])))
+            steps.append(('each', None))
+            pointer = ''
+
+        # handle multiple comma-separated keys
+        # this must be the leaf, because it doesn't make sense to extract more fields
+        # from differently keyed values (at least for now)
+        elif subkey.startswith('[') and subkey.endswith(']'):
+            if pointer:
+                steps.append(('pointer', pointer))
+                pointer = ''
+            steps.append(('fields', tuple(subkey[1:-1].split(","))))
+
+        # runs of regular keys collapse into a single JSON pointer lookup
+        else:
+            pointer += '/' + _escape_pointer_token(subkey)
+
+    if pointer:
+        steps.append(('pointer', pointer))
+
+    return tuple(steps)
+
+
+def _materialize(value):
+    # do not let simdjson proxies escape into the item, they hold on to the parser's buffer
+    if isinstance(value, simdjson.Object):
+        return value.as_dict()
+    if isinstance(value, simdjson.Array):
+        return value.as_list()
+    return value
+
+
+def parse_next_data(text: str):
+    """Parse the __NEXT_DATA__ blob of a book page into a lazy simdjson document"""
+    # A parser can only hold one document while proxies into it are alive,
+    # so each page gets its own parser instead of a shared module-level one
+    return simdjson.Parser().parse(text)
+
+
+def get_apollo_state(doc):
+    """The Apollo cache of a parsed __NEXT_DATA__ document, or None if the page has none"""
+    try:
+        return doc.at_pointer('/props/pageProps/apolloState')
+    except (LookupError, TypeError):
+        return None
+
+
+def visit_path(data, steps, original_key: str):
     if DEBUG:
-        print(f"Processing {key} for {data.keys() if type(data) == dict else data}")
+        print(f"Processing {steps} for {list(data.keys()) if isinstance(data, simdjson.Object) else data}")
 
     if not data:
-        if key and DEBUG:
+        if steps and DEBUG:
             print(f'No data found for key {original_key} in data')
             print(data)
         return None
 
-    # if no key is left, then yield the data at this point
-    if not key:
-        yield data
+    # if no step is left, then yield the data at this point
+    if not steps:
+        yield _materialize(data)
         # stop the generator since there is no more key left to parse
         return None
 
-    if '.' in key:
-        idx = key.index('.')
-        subkey, remaining_key = key[:idx], key[idx + 1:]
-    else:
-        subkey, remaining_key = key, None
-
-    # handle partial matches on the key
-    # this is needed when the key can be dynamic
-    if subkey.endswith('*'):
-        # remove '*'
-        subkey_prefix = subkey[:-1]
+    if not isinstance(data, (simdjson.Object, simdjson.Array)):
+        return None
 
-        # find all keys which match subkey_prefix
-        matching_subkeys = [k for k in data.keys() if k.startswith(subkey_prefix)]
+    (op, arg), remaining_steps = steps[0], steps[1:]
 
-        for sk in matching_subkeys:
-            yield from visit_path(data[sk], remaining_key, original_key)
+    if op == 'pointer':
+        try:
+            value = data.at_pointer(arg)
+        except (LookupError, TypeError):
+            value = None
+        yield from visit_path(value, remaining_steps, original_key)
 
-        return None
+    elif op == 'wildcard':
+        if not isinstance(data, simdjson.Object):
+            return None
 
-    # handle arrays
-    if subkey.endswith('[]'):
-        # remove '[]'
-        subkey = subkey[:-2]
+        # find all keys of the requested entity type
+        for sk in data.keys():
+            if sk.split(':', 1)[0] == arg:
+                yield from visit_path(data[sk], remaining_steps, original_key)
 
-        values = data.get(subkey, [])
+    elif op == 'each':
+        if not isinstance(data, simdjson.Array):
+            return None
 
-        for value in values:
-            yield from visit_path(value, remaining_key, original_key)
+        for value in data:
+            yield from visit_path(value, remaining_steps, original_key)
 
-        return None
-
-    # handle multiple comma-separated keys
-    # this must be the leaf, because it doesn't make sense to extract more fields
-    # from differently keyed values (at least for now)
-    if subkey.startswith('[') and subkey.endswith(']'):
-        subkeys = subkey[1:-1].split(",")
+    elif op == 'fields':
         value = {}
-        for sk in subkeys:
-            value[sk] = data.get(sk, None)
+        for sk in arg:
+            value[sk] = _materialize(data.get(sk, None)) if isinstance(data, simdjson.Object) else None
         yield value
 
-        return None
-
-    # handle regular keys
-    yield from visit_path(data.get(subkey, None), remaining_key, original_key)
-
     return None
 
 
-
-def json_field_extractor_v2(key: str):
-    def extract_field(text: str):
-        data = json.loads(text)
-        return list(visit_path(data, key, key))
-    return extract_field
+def strip_tags(html):
+    """Text content of an HTML snippet, parsed by lexbor in C instead of regex-based tag removal"""
+    # plain text (common for descriptions) has no tags or entities, so skip building a DOM for it
+    if '<' not in html and '&' not in html:
+        return html
+    return LexborHTMLParser(html).text(separator='')
 
 
 def splitter(split_on=','):
     return lambda s: s.split(split_on)
 
 
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+@functools.lru_cache(maxsize=8192)
 def safe_parse_date(date):
+    # Goodreads dates are almost always ISO-8601 or "March 26, 1911",
+    # so try those cheaply before falling back to dateutil's fuzzy parser
+    stripped = date.strip()
     try:
-        date = dateutil_parse(date, fuzzy=True, default=datetime.datetime.min)
-        date = date.strftime("%Y-%m-%d %H:%M:%S")
+        return datetime.datetime.fromisoformat(stripped).strftime(DATE_FORMAT)
     except ValueError:
+        pass
+
+    try:
+        return datetime.datetime.strptime(stripped, "%B %d, %Y").strftime(DATE_FORMAT)
+    except ValueError:
+        pass
+
+    try:
+        date = dateutil_parse(date, fuzzy=True, default=datetime.datetime.min)
+        date = date.strftime(DATE_FORMAT)
+    except (ValueError, OverflowError):
         date = None
 
     return date
 
 
-def filter_empty(vals):
-    return [v.strip() for v in vals if v.strip()]
+def dedup(vals):
+    """Drop duplicate values while keeping the order they were scraped in"""
+    return list(dict.fromkeys(vals))
 
 
-def split_by_newline(txt):
-    return txt.split("\n")
+def clean_lines(txt):
+    """Split text into stripped, non-empty lines"""
+    return [s for s in (line.strip() for line in txt.splitlines()) if s]
 
 
 def deduplicate_text(text):
     """Remove duplicated consecutive text in author bios"""
     if not text or len(text) < 100:
         return text
-    
+
     # Try different split points to find where duplication starts
     # The duplicate typically starts around 40-60% through the text
-    for split_point in range(len(text) // 3, (len(text) * 2) // 3):
-        first_part = text[:split_point]
-        second_part = text[split_point:]
-        
-        # Check if first_part appears at the start of second_part
-        # Use first 100 chars as a signature to detect duplication
-        signature_len = min(100, len(first_part))
-        if signature_len > 50 and second_part.startswith(first_part[:signature_len]):
-            return first_part
-    
+    start, end = len(text) // 3, (len(text) * 2) // 3
+
+    # Check if the text at the split point repeats the start of the text
+    # Use first 100 chars (and more than 50) as a signature to detect duplication
+    for split_point in range(max(start, 51), min(end, 100)):
+        if text.startswith(text[:split_point], split_point):
+            return text[:split_point]
+
+    # Past 100 chars the signature is fixed, so the whole scan is a single
+    # substring search that str.find runs in C without copying the text
+    start = max(start, 100)
+    if start < end:
+        split_point = text.find(text[:100], start, end + 99)
+        if split_point != -1:
+            return text[:split_point]
+
     return text
 
 
-def extract_contributors_with_roles(key: str):
-    """Extract contributor names with their roles from primary and secondary contributor edges"""
-    def extract(text: str):
-        data = json.loads(text)
-        contributors = []
-        
-        # Get all Book objects
-        apollo_state = data.get('props', {}).get('pageProps', {}).get('apolloState', {})
-        for book_key in [k for k in apollo_state.keys() if k.startswith('Book:')]:
-            book = apollo_state[book_key]
-            
-            # Primary contributor (usually the main author)
-            primary = book.get('primaryContributorEdge')
-            if primary:
-                contributor_ref = primary.get('node', {}).get('__ref')
-                if contributor_ref and contributor_ref in apollo_state:
-                    contributor_name = apollo_state[contributor_ref].get('name')
-                    if contributor_name:
-                        contributors.append({
-                            'name': contributor_name,
-                            'role': primary.get('role', 'Unknown')
-                        })
-            
-            # Secondary contributors (translators, editors, etc.)
-            secondary = book.get('secondaryContributorEdges', [])
-            for edge in secondary:
-                contributor_ref = edge.get('node', {}).get('__ref')
-                if contributor_ref and contributor_ref in apollo_state:
-                    contributor_name = apollo_state[contributor_ref].get('name')
-                    if contributor_name:
-                        contributors.append({
-                            'name': contributor_name,
-                            'role': edge.get('role', 'Unknown')
-                        })
-        
-        return [contributors] if contributors else []
-    return extract
+def extract_contributors_with_roles(contributor_names, books):
+    """Extract contributor names with their roles from primary and secondary contributor edges
+
+        contributor_names maps Contributor refs to names and books holds the Book objects,
+        both gathered while walking the Apollo state, so each edge resolves with a dict lookup
+    """
+    # Primary contributor (usually the main author) first,
+    # then secondary contributors (translators, editors, etc.)
+    edges = []
+    for book in books:
+        primary = book.get('primaryContributorEdge')
+        if primary:
+            edges.append(primary)
+        edges.extend(book.get('secondaryContributorEdges') or [])
+
+    contributors = [
+        {'name': contributor_names[ref], 'role': edge.get('role', 'Unknown')}
+        for edge in edges
+        if contributor_names.get(ref := edge.get('node', {}).get('__ref'))
+    ]
+
+    return [contributors] if contributors else []
+
+
+# Paths into the Apollo state of a book page for each JSON-backed BookItem field.
+# Each path starts with the entity type (Book, Work, ...) the field is read from.
+BOOK_FIELD_PATHS = {
+    'title': 'Book*.title',
+    'titleComplete': 'Book*.titleComplete',
+    'description': 'Book*.description',
+    'imageUrl': 'Book*.imageUrl',
+    'genres': 'Book*.bookGenres[].genre.name',
+    'asin': 'Book*.details.asin',
+    'isbn': 'Book*.details.isbn',
+    'isbn13': 'Book*.details.isbn13',
+    'publisher': 'Book*.details.publisher',
+    'publishDate': 'Book*.details.publicationTime',
+    'series': 'Series*.title',
+    'author': 'Contributor*.name',
+    'places': 'Work*.details.places[].name',
+    'characters': 'Work*.details.characters[].name',
+    'awards': 'Work*.details.awardsWon[].[name,awardedAt,category,hasWon]',
+    'ratingsCount': 'Work*.stats.ratingsCount',
+    'reviewsCount': 'Work*.stats.textReviewsCount',
+    'avgRating': 'Work*.stats.averageRating',
+    'ratingHistogram': 'Work*.stats.ratingsCountDist',
+    'numPages': 'Book*.details.numPages',
+    'language': 'Book*.details.language.name',
+    'format': 'Book*.details.language.format',
+}
+
+
+def _group_paths_by_entity_type(field_paths):
+    """Compile field paths and group them by the entity type of their leading wildcard"""
+    grouped = defaultdict(list)
+    for field, path in field_paths.items():
+        (op, entity_type), *steps = _compile_path(path)
+        assert op == 'wildcard', f'{path} does not start with an entity type'
+        grouped[entity_type].append((field, tuple(steps), path))
+    return dict(grouped)
+
+
+_BOOK_FIELD_STEPS = _group_paths_by_entity_type(BOOK_FIELD_PATHS)
+
+
+def extract_all_book_fields(apollo_state):
+    """Extract every JSON-backed BookItem field in a single pass over the Apollo state
+
+        Returns a dict mapping field names to lists of values, ready for ItemLoader.add_value
+    """
+    fields = defaultdict(list)
+    # contributors are resolved from these once the pass is done
+    contributor_names = {}
+    books = []
+
+    # iterate keys rather than items(), which would materialise every entity into a dict
+    for key in apollo_state.keys():
+        entity_type = key.split(':', 1)[0]
+        field_steps = _BOOK_FIELD_STEPS.get(entity_type, ())
+        if not field_steps and entity_type not in ('Book', 'Contributor'):
+            continue
+
+        entity = apollo_state[key]
+        for field, steps, path in field_steps:
+            fields[field].extend(visit_path(entity, steps, path))
+
+        if entity_type == 'Contributor':
+            contributor_names[key] = entity.get('name')
+        elif entity_type == 'Book':
+            books.append(entity)
+
+    fields['contributors'] = extract_contributors_with_roles(contributor_names, books)
+    return fields
 
 
 class BookItem(scrapy.Item):
     # Scalars
     url = Field()
 
-    title = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.title')))
-    titleComplete = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.titleComplete')))
-    description = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.description'), remove_tags))
-    imageUrl = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.imageUrl')))
-    genres = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.bookGenres[].genre.name')), output_processor=Compose(set, list))
-    asin = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.asin')))
-    isbn = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.isbn')))
-    isbn13 = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.isbn13')))
-    publisher = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.publisher')))
-    publishDate = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.publicationTime')))
-    series = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Series*.title')), output_processor=Compose(set, list))
+    title = Field()
+    titleComplete = Field()
+    description = Field(input_processor=MapCompose(strip_tags))
+    imageUrl = Field()
+    genres = Field(output_processor=dedup)
+    asin = Field()
+    isbn = Field()
+    isbn13 = Field()
+    publisher = Field()
+    publishDate = Field()
+    series = Field(output_processor=dedup)
 
-    author = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Contributor*.name')), output_processor=Compose(set, list))
-    contributors = Field(input_processor=MapCompose(extract_contributors_with_roles('contributors')), output_processor=Compose(TakeFirst(), list))
+    author = Field(output_processor=dedup)
+    contributors = Field(output_processor=Compose(TakeFirst(), list))
 
-    places = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.details.places[].name')), output_processor=Compose(set, list))
-    characters = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.details.characters[].name')), output_processor=Compose(set, list))
-    awards = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.details.awardsWon[].[name,awardedAt,category,hasWon]')), output_processor=Identity())
+    places = Field(output_processor=dedup)
+    characters = Field(output_processor=dedup)
+    awards = Field(output_processor=Identity())
 
-    ratingsCount = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.stats.ratingsCount')))
-    reviewsCount = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.stats.textReviewsCount')))
-    avgRating = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.stats.averageRating')))
-    ratingHistogram = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Work*.stats.ratingsCountDist')))
+    ratingsCount = Field()
+    reviewsCount = Field()
+    avgRating = Field()
+    ratingHistogram = Field()
 
-    numPages = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.numPages')))
-    language = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.language.name')))
-    format = Field(input_processor=MapCompose(json_field_extractor_v2('props.pageProps.apolloState.Book*.details.language.format')))
+    numPages = Field()
+    language = Field()
+    format = Field()
 
 
 class BookLoader(ItemLoader):
@@ -235,14 +377,13 @@ class AuthorItem(scrapy.Item):
     reviewsCount = Field(serializer=int)
 
     # Lists
-    genres = Field(output_processor=Compose(set, list))
-    influences = Field(output_processor=Compose(set, list))
+    genres = Field(output_processor=dedup)
+    influences = Field(output_processor=dedup)
 
     # Blobs
     about = Field(
         # Take the first match, remove HTML tags, convert to list of lines, remove empty lines, remove the "edit data" prefix, then deduplicate
-        input_processor=Compose(TakeFirst(), remove_tags, split_by_newline,
-                                filter_empty, lambda s: s[1:]),
+        input_processor=Compose(TakeFirst(), strip_tags, clean_lines, lambda s: s[1:]),
         output_processor=Compose(Join(), deduplicate_text))
 
 
@@ -3,7 +3,7 @@
 import scrapy
 
 from .author_spider import AuthorSpider
-from ..items import BookItem, BookLoader
+from ..items import BookItem, BookLoader, extract_all_book_fields, get_apollo_state, parse_next_data
 
 class BookSpider(scrapy.Spider):
     """Extract information from a /book/show type page on Goodreads
@@ -28,32 +28,13 @@ class BookSpider(scrapy.Spider):
         loader.add_value('url', response.request.url)
 
         # The new Goodreads page sends JSON in a script tag
-        # that has these values
-
-        loader.add_css('title', 'script#__NEXT_DATA__::text')
-        loader.add_css('titleComplete', 'script#__NEXT_DATA__::text')
-        loader.add_css('description', 'script#__NEXT_DATA__::text')
-        loader.add_css('imageUrl', 'script#__NEXT_DATA__::text')
-        loader.add_css('genres', 'script#__NEXT_DATA__::text')
-        loader.add_css('asin', 'script#__NEXT_DATA__::text')
-        loader.add_css('isbn', 'script#__NEXT_DATA__::text')
-        loader.add_css('isbn13', 'script#__NEXT_DATA__::text')
-        loader.add_css('publisher', 'script#__NEXT_DATA__::text')
-        loader.add_css('series', 'script#__NEXT_DATA__::text')
-        loader.add_css('author', 'script#__NEXT_DATA__::text')
-        loader.add_css('contributors', 'script#__NEXT_DATA__::text')
-        loader.add_css('publishDate', 'script#__NEXT_DATA__::text')
-
-        loader.add_css('characters', 'script#__NEXT_DATA__::text')
-        loader.add_css('places', 'script#__NEXT_DATA__::text')
-        loader.add_css('ratingHistogram', 'script#__NEXT_DATA__::text')
-        loader.add_css("ratingsCount", 'script#__NEXT_DATA__::text')
-        loader.add_css("reviewsCount", 'script#__NEXT_DATA__::text')
-        loader.add_css('numPages', 'script#__NEXT_DATA__::text')
-        loader.add_css("format", 'script#__NEXT_DATA__::text')
-
-        loader.add_css('language', 'script#__NEXT_DATA__::text')
-        loader.add_css("awards", 'script#__NEXT_DATA__::text')
+        # that has these values. Parse it once and extract every
+        # field in a single pass over its Apollo state
+        next_data = response.css('script#__NEXT_DATA__::text').get()
+        apollo_state = get_apollo_state(parse_next_data(next_data)) if next_data else None
+        if apollo_state:
+            for field, values in extract_all_book_fields(apollo_state).items():
+                loader.add_value(field, values)
 
         yield loader.load_item()
 
@@ -1,45 +1,238 @@
 #!/usr/bin/env python3
-import json
 import glob
+import mmap
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+import orjson
+import rbloom
+import xxhash
+
+
+def _iter_lines(filename):
+    """Yield the lines of a file as bytes, without the trailing newline
+
+    The file is memory-mapped and split with mmap.find, so lines are never
+    decoded or read through Python's line iterator.
+    """
+    # mmap refuses to map empty files
+    if os.path.getsize(filename) == 0:
+        return
+
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while (end := mm.find(b'\n', start)) != -1:
+            yield mm[start:end]
+            start = end + 1
+
+        # last line without a trailing newline
+        if start < len(mm):
+            yield mm[start:]
+
+
+def _iter_items(filename, stats):
+    """Yield (url_hash, line) pairs for the items of one JSON Lines file that have a URL
+
+    Lines are yielded in file order as compact JSON, repeated URLs
+    included. The number of lines read is counted in stats['lines'].
+    """
+    print(f"Reading {filename}...")
+
+    for line in _iter_lines(filename):
+        stats['lines'] += 1
+        try:
+            # orjson parses the bytes slice directly
+            item = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            print(f"Error parsing line in {filename}: {e}")
+            continue
+
+        url = item.get('url')
+        if not url:
+            continue
+
+        # compact JSON with the newline appended by orjson, ready to be written as is
+        yield xxhash.xxh3_64_intdigest(url.encode()), orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def _parse_file(filename, dedupe_within_file=True):
+    """Parse one JSON Lines file in a worker process
+
+    Returns the (url_hash, line) pairs of its items along with the line
+    count stats. With dedupe_within_file, repeated URLs within the file are
+    dropped here so they are not pickled back to the main process.
+    """
+    stats = {'lines': 0}
+    if not dedupe_within_file:
+        return list(_iter_items(filename, stats)), stats
 
-def combine_and_dedupe(pattern, output_file):
-    """Combine JSON Lines files and deduplicate by URL"""
     seen_urls = set()
-    unique_items = []
+    parsed = []
+    for url_hash, line in _iter_items(filename, stats):
+        if url_hash not in seen_urls:
+            seen_urls.add(url_hash)
+            parsed.append((url_hash, line))
+    return parsed, stats
+
+
+def _parse_files(files, dedupe_within_file=True):
+    """Yield (pairs, stats) for each file, in file order
+
+    With several files and CPUs the files are parsed in worker processes,
+    with at most one file per worker in flight so finished results never
+    pile up in memory. Otherwise each file's pairs are streamed from this
+    process without any per-file dedup, leaving the caller's index as the
+    only one, and its stats are complete once its pairs have been consumed.
+    dedupe_within_file is passed on to _parse_file.
+    """
+    max_workers = os.cpu_count() or 1
+    if len(files) <= 1 or max_workers == 1:
+        for filename in files:
+            stats = {'lines': 0}
+            yield _iter_items(filename, stats), stats
+        return
+
+    with ProcessPoolExecutor(max_workers) as executor:
+        pending = deque()
+        for filename in files:
+            pending.append(executor.submit(_parse_file, filename, dedupe_within_file))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+BLOOM_FALSE_POSITIVE_RATE = 1e-4
+
+
+def make_seen_index(expected_items=None):
+    """Index of seen URL fingerprints
+
+    An exact set by default. When expected_items is given, a fixed-size
+    Bloom filter is used instead and it is the only dedup index, so its
+    memory does not grow with the number of URLs, at the cost of wrongly
+    dropping about BLOOM_FALSE_POSITIVE_RATE of the unique items. Lines
+    of files parsed by worker processes are still held while in flight.
+    """
+    if expected_items is None:
+        # xxh3 fingerprints take 8 bytes per URL instead of a full str object
+        return set()
+    return rbloom.Bloom(expected_items, BLOOM_FALSE_POSITIVE_RATE)
+
+
+def combine_and_dedupe(pattern, output_file, expected_items=None):
+    """Combine JSON Lines files and deduplicate by URL
+
+    Files are parsed (in worker processes when there is more than one file
+    and CPU) and merged in sorted file order, so the first occurrence of a
+    URL wins. Unique items are streamed to output_file (JSON Lines) as soon
+    as they are merged. Memory holds the index of 64-bit URL fingerprints
+    plus the parsed lines of at most one file per worker.
+    See make_seen_index for expected_items.
+    """
+    seen_urls = make_seen_index(expected_items)
+    unique_count = 0
+    total_count = 0
     
     # Get all batch files matching the pattern
     files = sorted(glob.glob(pattern))
     print(f"Processing {len(files)} files matching {pattern}")
     
+    with open(output_file, 'wb') as out:
+        # an exact per-file set in the workers would undo the Bloom filter's fixed memory
+        for parsed, stats in _parse_files(files, dedupe_within_file=expected_items is None):
+            for url_hash, line in parsed:
+                if url_hash not in seen_urls:
+                    seen_urls.add(url_hash)
+                    out.write(line)
+                    unique_count += 1
+            total_count += stats['lines']
+    
+    print(f"Done! Wrote {unique_count} unique items to {output_file} (from {total_count} total)")
+    return unique_count
+
+
+def combine_to_parquet(pattern, output_file):
+    """Combine JSON Lines files into a Parquet file and deduplicate by URL
+
+    The files are loaded as Arrow tables and deduplicated with Arrow's
+    vectorized hash aggregation. Like combine_and_dedupe, rows with a
+    missing or empty URL are dropped and the first row of each URL is
+    kept. Unlike combine_and_dedupe, the whole dataset is held in memory
+    and a malformed line fails the read instead of being skipped.
+    """
+    # pyarrow is only needed for this output, so the default JSON Lines path runs without it
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.json as paj
+    import pyarrow.parquet as pq
+
+    files = [f for f in sorted(glob.glob(pattern)) if os.path.getsize(f) > 0]
+    print(f"Processing {len(files)} files matching {pattern}")
+    if not files:
+        return 0
+
+    tables = []
     for filename in files:
         print(f"Reading {filename}...")
-        with open(filename, 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    item = json.loads(line.strip())
-                    url = item.get('url')
-                    
-                    if url and url not in seen_urls:
-                        seen_urls.add(url)
-                        unique_items.append(item)
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing line in {filename}: {e}")
-                    continue
-    
-    # Write to output file
-    print(f"Writing {len(unique_items)} unique items to {output_file}")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(unique_items, f, indent=2, ensure_ascii=False)
-    
-    print(f"Done! {len(unique_items)} unique items (from {sum(1 for _ in open(files[0] if files else '', encoding='utf-8')) if files else 0} total)")
-    return len(unique_items)
+        tables.append(paj.read_json(filename))
+
+    # files may disagree on a column's type, e.g. when it is null throughout one of them
+    combined = pa.concat_tables(tables, promote_options='permissive')
+    total_count = combined.num_rows
+    if 'url' not in combined.column_names:
+        print(f"No url column in files matching {pattern}, nothing to write")
+        return 0
+
+    # number the rows that have a URL, then keep the lowest row number of each URL
+    # (the cast handles a url column that is null throughout, which Arrow types as null)
+    has_url = pc.fill_null(pc.not_equal(combined['url'].cast(pa.string()), ''), False)
+    combined = combined.filter(has_url)
+    combined = combined.append_column('__row', pa.array(range(combined.num_rows), type=pa.int64()))
+    first_rows = combined.group_by('url', use_threads=False).aggregate([('__row', 'min')])['__row_min']
+    first_rows = pc.take(first_rows, pc.sort_indices(first_rows))
+    deduped = combined.take(first_rows).drop_columns(['__row'])
+
+    pq.write_table(deduped, output_file)
+
+    print(f"Done! Wrote {deduped.num_rows} unique items to {output_file} (from {total_count} total)")
+    return deduped.num_rows
+
+
+@click.command()
+@click.option("--expected_items",
+              help="Deduplicate approximately with a Bloom filter sized for this many URLs per item type, "
+                   "instead of an exact in-memory set. Only applies to --format jl",
+              type=int)
+@click.option("--format",
+              "output_format",
+              help="Output format. parquet deduplicates in memory with pyarrow",
+              type=click.Choice(["jl", "parquet"]),
+              default="jl",
+              show_default=True)
+def main(expected_items, output_format):
+    """Combine and deduplicate book and author batch files"""
+    if output_format == 'parquet':
+        if expected_items is not None:
+            raise click.UsageError("--expected_items only applies to --format jl")
+        combine = combine_to_parquet
+    else:
+        def combine(pattern, output_file):
+            return combine_and_dedupe(pattern, output_file, expected_items)
+
+    # Combine books
+    book_count = combine('book_batch*.jl', f'books-scraped.{output_format}')
+
+    # Combine authors
+    author_count = combine('author_batch*.jl', f'authors-scraped.{output_format}')
 
-# Combine books
-book_count = combine_and_dedupe('book_batch*.jl', 'books-scraped.json')
+    print(f"\nSummary:")
+    print(f"  Books: {book_count} unique")
+    print(f"  Authors: {author_count} unique")
 
-# Combine authors
-author_count = combine_and_dedupe('author_batch*.jl', 'authors-scraped.json')
 
-print(f"\nSummary:")
-print(f"  Books: {book_count} unique")
-print(f"  Authors: {author_count} unique")
+if __name__ == "__main__":
+    main()